@@ -37,7 +37,7 @@
 # Created:                  December 18, 2018
 # Version:                  0.0.3
 # Source/Inspiration:       https://gist.github.com/phill-tornroth/f0ef50f9402c7c94cbafd8c94bbec9c9
-# Requires:                 Python 3.6+ (fstrings)
+# Requires:                 Python 3.8+ (shlex.join)
 #                           boto3 module
 # Assumes:                  AWS credentials are environment vars or supplied
 #                           outside of this script.
@@ -49,17 +49,28 @@
 #                                Import Modules                                #
 ################################################################################
 
+from concurrent.futures import ThreadPoolExecutor
 from os import environ
 from sys import argv
 import argparse
+import shlex
 
 import boto3
+from botocore.config import Config
 
 ################################################################################
 #                                  Variables                                   #
 ################################################################################
 
 default_source_region = environ['AWS_DEFAULT_REGION']
+# Shell escaped command line recorded in the 'CopiedUsingCmd' tag.
+invocation_cmd = shlex.join(argv)
+# Parameter fields that determine whether a parameter differs between groups. Metadata such as 'Source' or 'Description' is ignored.
+compared_parameter_fields = ("ParameterValue",)
+# Echo each posted parameter when set from the command line ('-v').
+verbose = False
+# Adaptive retries back off on throttling and the larger pool covers the concurrent requests.
+rds_client_config = Config(retries={"mode": "adaptive", "max_attempts": 10}, max_pool_connections=16)
 argparse_description = """
 Cross AWS region capable for any action.
 
@@ -80,9 +91,15 @@ the destination.
 def append_if_value_present(list_to_append, eval_append):
     """
     Checks to see if the "ParameterValue" key is present in the 'eval_append' dict.
+
+    Only the fields needed to post the parameter to a group are appended.
     """
     if "ParameterValue" in eval_append:
-        list_to_append.append(eval_append)
+        list_to_append.append({
+            "ParameterName": eval_append["ParameterName"],
+            "ParameterValue": eval_append["ParameterValue"],
+            "ApplyMethod": eval_append.get("ApplyMethod", "pending-reboot"),
+        })
 
 
 def change_list_to_dict(list_to_convert, key):
@@ -94,32 +111,24 @@ def change_list_to_dict(list_to_convert, key):
     Assumes the key is unique.
     """
 
-    dict_to_export = {}
-
-    for each_obj_in_list in list_to_convert:
-
-        # Check if key already exists in dictionary.
-        if key in dict_to_export.keys():
-            raise Exception(f"This key name is not unique.")
+    dict_to_export = {each_obj_in_list[key]: each_obj_in_list for each_obj_in_list in list_to_convert}
 
-        dict_to_export[each_obj_in_list[key]] = each_obj_in_list
+    # Duplicate keys collapse into one entry, so a length mismatch means the key is not unique.
+    if len(dict_to_export) != len(list_to_convert):
+        raise Exception(f"This key name is not unique.")
 
     return dict_to_export
 
 
 def chunks(sequence, chunk_size):
     """
-    Yields the sequence as a sequence of sequences size in chunk_size (or fewer,
+    Returns the sequence as a sequence of sequences size in chunk_size (or fewer,
     in the case of the last chunk). Guarantees delivery of everything (as
     opposed to strategies that leave elements off of the end when:
     len(sequence) % chunk_size != 0
     """
 
-    start = 0
-    while start < len(sequence):
-        end = start + chunk_size
-        yield sequence[start : start + chunk_size]
-        start = end
+    return (sequence[start : start + chunk_size] for start in range(0, len(sequence), chunk_size))
 
 
 def copy_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_client_obj, dest_param_group):
@@ -127,15 +136,20 @@ def copy_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_clie
     Copies a parameter group.
     """
 
-    # Construct variables
-    source_summary = source_rds_client_obj.describe_db_parameter_groups(DBParameterGroupName=source_param_group)
+    # Fetch the source summary and parameters, and check for the dest group concurrently as all are network bound.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        source_summary_future = executor.submit(source_rds_client_obj.describe_db_parameter_groups, DBParameterGroupName=source_param_group)
+        source_parameters_future = executor.submit(return_all_modifiable_parameters_with_value_from_parameter_group, source_rds_client_obj, source_param_group)
+        dest_exists_future = executor.submit(parameter_group_exists, dest_rds_client_obj, dest_param_group)
+        source_summary = source_summary_future.result()
+        source_parameters = source_parameters_future.result()
+        dest_exists = dest_exists_future.result()
+
     source_family = source_summary["DBParameterGroups"][0]["DBParameterGroupFamily"]
     source_description = source_summary["DBParameterGroups"][0]["Description"]
-    source_parameters = return_all_modifiable_parameters_with_value_from_parameter_group(source_rds_client_obj, source_param_group)
-    groups_in_dest_region = return_parameter_groups(dest_rds_client_obj)
 
     # Error if 'dest_param_group' already exists.
-    if dest_param_group in groups_in_dest_region:
+    if dest_exists:
         raise ValueError(f"This group ({dest_param_group}) already exists in region.")
 
     print(f"Created {dest_param_group}:")
@@ -149,7 +163,7 @@ def copy_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_clie
         },
         {
             'Key': 'CopiedUsingCmd',
-            'Value': " ".join(argv)
+            'Value': invocation_cmd
         },
         {
             'Key': 'Repo',
@@ -177,17 +191,13 @@ def compare_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_c
     """
 
     # Construct variables
-    diff_list = []
-    source_summary = source_rds_client_obj.describe_db_parameter_groups(DBParameterGroupName=source_param_group)
-    source_family = source_summary["DBParameterGroups"][0]["DBParameterGroupFamily"]
-    source_parameters = return_all_parameters_from_parameter_group(source_rds_client_obj, source_param_group)
-    dest_summary = dest_rds_client_obj.describe_db_parameter_groups(DBParameterGroupName=dest_param_group)
-    dest_family = dest_summary["DBParameterGroups"][0]["DBParameterGroupFamily"]
-    dest_parameters = return_all_parameters_from_parameter_group(dest_rds_client_obj, dest_param_group)
+    comparison = return_parameter_groups_comparison(source_rds_client_obj, source_param_group, dest_rds_client_obj, dest_param_group)
+    source_family = comparison["source_family"]
+    dest_family = comparison["dest_family"]
 
     print(f"Comparing {source_param_group} and {dest_param_group}")
-    print(f"    Number of 'source_parameters' to compare: {len(source_parameters)}")
-    print(f"    Number of 'dest_parameters' to compare:   {len(dest_parameters)}")
+    print(f"    Number of 'source_parameters' to compare: {len(comparison['source_parameters'])}")
+    print(f"    Number of 'dest_parameters' to compare:   {len(comparison['dest_parameters'])}")
 
     # Notify that the 'DBParameterGroupFamily' don't match as it will be indicative of many differences in the compare.
     if source_family != dest_family:
@@ -203,30 +213,9 @@ def compare_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_c
     print(f"< Source parameter group name:      {source_param_group}")
     print(f"> Destination parameter group name: {dest_param_group}")
 
-    # Convert list to dictionaries to lookup by key ('ParameterName').
-    source_parameters = change_list_to_dict(source_parameters, "ParameterName")
-    dest_parameters = change_list_to_dict(dest_parameters, "ParameterName")
-
-    # Compare source to dest, delete mutuals keys from 'dest_parameters' as compared is processed.
-    for param_name, param_value in source_parameters.items():
-        if param_name not in dest_parameters.keys():
-            print(f"{param_name}:")
-            print(f"< {source_parameters[param_name]}")
-            append_if_value_present(diff_list, source_parameters[param_name])
-        elif source_parameters[param_name] != dest_parameters[param_name]:
-            print(f"{param_name}:")
-            print(f"< {source_parameters[param_name]}")
-            print(f"> {dest_parameters[param_name]}")
-            append_if_value_present(diff_list, source_parameters[param_name])
-
-            # Delete from dict to prevent showing on the second compare.
-            del dest_parameters[param_name]
-
-    # Show remaining dest parameters that do not exist in the source parameters.
-    for param_name, param_value in dest_parameters.items():
-        if param_name not in source_parameters.keys():
-            print(f"{param_name}:")
-            print(f"> {dest_parameters[param_name]}")
+    # Write the diff lines out at once rather than a print() per line.
+    if comparison["diff_output"]:
+        print("\n".join(comparison["diff_output"]))
 
     print("")
     print("")
@@ -235,7 +224,7 @@ def compare_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_c
     if return_list == False:
         print("Complete.")
     else:
-        return diff_list
+        return comparison["diff_list"]
 
 
 def merge_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_client_obj, dest_param_group):
@@ -252,6 +241,20 @@ def merge_rds_parameters(source_rds_client_obj, source_param_group, dest_rds_cli
     post_parameters_to_group(dest_rds_client_obj, dest_param_group, parameters_diff)
 
 
+def parameter_group_exists(rds_client_obj, param_group):
+    """
+    Returns True if the parameter group exists in the client's region.
+    """
+
+    # Look up the single group by name rather than listing every group in the region.
+    try:
+        rds_client_obj.describe_db_parameter_groups(DBParameterGroupName=param_group)
+    except rds_client_obj.exceptions.DBParameterGroupNotFoundFault:
+        return False
+
+    return True
+
+
 def post_parameters_to_group(rds_client_obj, param_group, parameters):
     """
     Modifies the parameters in a parameter group and post in 20x chunks.
@@ -261,96 +264,132 @@ def post_parameters_to_group(rds_client_obj, param_group, parameters):
     if len(parameters) == 0:
         return
 
-    # Posts changes to AWS using 20 parameters chunks due to API limit.
-    for parameter_chunk in chunks(parameters, 20):
+    parameter_chunks = list(chunks(parameters, 20))
 
-        # Modified Parameter Group.
-        rds_client_obj.modify_db_parameter_group(DBParameterGroupName=param_group, Parameters=parameter_chunk)
+    # Posts changes to AWS using 20 parameters chunks due to API limit, 4 chunks at a time.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for chunk_batch in chunks(parameter_chunks, 4):
+            batch_futures = [
+                executor.submit(rds_client_obj.modify_db_parameter_group, DBParameterGroupName=param_group, Parameters=parameter_chunk)
+                for parameter_chunk in chunk_batch
+            ]
 
-        # Print parameters
-        for p in parameter_chunk:
-            print(f"    {p['ParameterName']} = {p['ParameterValue']}")
+            # Finish the batch before starting the next so a failure stops any further chunks from posting.
+            for chunk_future in batch_futures:
+                chunk_future.result()
 
+    # Print parameters in chunk order once every chunk has posted.
+    if verbose:
+        for parameter_chunk in parameter_chunks:
+            for p in parameter_chunk:
+                print(f"    {p['ParameterName']} = {p['ParameterValue']}")
 
-def return_parameter_groups(rds_client_obj):
-    """
-    Returns all the parameter groups in a region.
+
+def return_parameter_groups_comparison(source_rds_client_obj, source_param_group, dest_rds_client_obj, dest_param_group):
     """
+    Fetches two parameter groups and returns their differences.
 
-    groups_to_return = []
-    pagination_token = None
+    Returns a dictionary with the 'source_family', 'dest_family', 'source_parameters' and
+    'dest_parameters' (keyed by 'ParameterName'), the 'diff_list' of source parameters to
+    post to the destination, and the 'diff_output' lines describing the differences.
+    """
 
-    # Iterate through all parameters in parameter group and break out when appropriate.
-    while(True):
+    # Construct variables
+    diff_list = []
 
-        # Returns when last iteration "Marker" was missing, otherwise retrieves parameters.
-        if pagination_token == False:
-            break
-        elif pagination_token == None:
-            group_chunk = rds_client_obj.describe_db_parameter_groups()
-        else:
-            group_chunk = rds_client_obj.describe_db_parameter_groups(Marker=pagination_token)
+    # Fetch the source and dest summaries and parameters concurrently as all are network bound.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        source_summary_future = executor.submit(source_rds_client_obj.describe_db_parameter_groups, DBParameterGroupName=source_param_group)
+        dest_summary_future = executor.submit(dest_rds_client_obj.describe_db_parameter_groups, DBParameterGroupName=dest_param_group)
+        source_parameters_future = executor.submit(return_all_parameters_from_parameter_group, source_rds_client_obj, source_param_group)
+        dest_parameters_future = executor.submit(return_all_parameters_from_parameter_group, dest_rds_client_obj, dest_param_group)
+        source_summary = source_summary_future.result()
+        dest_summary = dest_summary_future.result()
+        source_parameters = source_parameters_future.result()
+        dest_parameters = dest_parameters_future.result()
 
-        # Iterate through each parameter group name.
-        for g in group_chunk["DBParameterGroups"]:
-            groups_to_return.append(g["DBParameterGroupName"])
+    source_family = source_summary["DBParameterGroups"][0]["DBParameterGroupFamily"]
+    dest_family = dest_summary["DBParameterGroups"][0]["DBParameterGroupFamily"]
 
-        # Boto3 returns a field "Marker" when the returned parameter groups have been paginated. If missing, time to return function.
-        if "Marker" in group_chunk:
-            pagination_token = group_chunk['Marker']
-        else:
-            pagination_token = False
+    # Convert list to dictionaries to lookup by key ('ParameterName').
+    source_parameters = change_list_to_dict(source_parameters, "ParameterName")
+    dest_parameters = change_list_to_dict(dest_parameters, "ParameterName")
 
-    return groups_to_return
+    # Split the parameter names into those only in source, in both, and only in dest.
+    source_keys = set(source_parameters)
+    dest_keys = set(dest_parameters)
+    only_source_keys = source_keys - dest_keys
+    mutual_keys = source_keys & dest_keys
+    only_dest_keys = dest_keys - source_keys
+
+    # Collect the diff lines to be displayed by the caller.
+    diff_output = []
+
+    # Source parameters that do not exist in the dest parameters.
+    for param_name in sorted(only_source_keys):
+        source_value = source_parameters[param_name]
+        diff_output.append(f"{param_name}:")
+        diff_output.append(f"< {source_value}")
+        append_if_value_present(diff_list, source_value)
+
+    # Parameters that exist in both but differ.
+    for param_name in sorted(mutual_keys):
+        source_value = source_parameters[param_name]
+        dest_value = dest_parameters[param_name]
+        source_fields = tuple(source_value.get(f) for f in compared_parameter_fields)
+        dest_fields = tuple(dest_value.get(f) for f in compared_parameter_fields)
+        if source_fields != dest_fields:
+            diff_output.append(f"{param_name}:")
+            diff_output.append(f"< {source_value}")
+            diff_output.append(f"> {dest_value}")
+            append_if_value_present(diff_list, source_value)
+
+    # Dest parameters that do not exist in the source parameters.
+    for param_name in sorted(only_dest_keys):
+        diff_output.append(f"{param_name}:")
+        diff_output.append(f"> {dest_parameters[param_name]}")
+
+    return {
+        "source_family": source_family,
+        "dest_family": dest_family,
+        "source_parameters": source_parameters,
+        "dest_parameters": dest_parameters,
+        "diff_list": diff_list,
+        "diff_output": diff_output,
+    }
 
 
 def return_all_modifiable_parameters_with_value_from_parameter_group(rds_client_obj, param_group):
     """
     Returns all the modifiable parameters that have a value to set.
     """
-    all_parameters = return_all_parameters_from_parameter_group(rds_client_obj, param_group)
-    parameters_to_return = []
 
-    # Iterate through each parameter.
-    for p in all_parameters:
+    # Only user set parameters are requested as they are modifiable, have a value, and differ from the family defaults.
+    user_parameters = return_all_parameters_from_parameter_group(rds_client_obj, param_group, source="user")
+    parameters_to_return = []
 
-        # Only modifiable parameters ('IsModifiable' == True) with a settable value ('ParameterValue').
-        if p["IsModifiable"]:
-            append_if_value_present(parameters_to_return, p)
+    # Keep only the fields needed to post, to shrink the serialized modify requests.
+    for p in user_parameters:
+        append_if_value_present(parameters_to_return, p)
 
     return parameters_to_return
 
 
-def return_all_parameters_from_parameter_group(rds_client_obj, param_group):
+def return_all_parameters_from_parameter_group(rds_client_obj, param_group, source=None):
     """
     Returns all the parameters for a parameter group.
-    """
 
-    parameters_to_return = []
-    pagination_token = None
-
-    # Iterate through all parameters in parameter group and break out when appropriate.
-    while(True):
-
-        # Returns when last iteration "Marker" was missing, otherwise retrieves parameters.
-        if pagination_token == False:
-            break
-        elif pagination_token == None:
-            param_chunk = rds_client_obj.describe_db_parameters(DBParameterGroupName=param_group)
-        else:
-            param_chunk = rds_client_obj.describe_db_parameters(DBParameterGroupName=param_group, Marker=pagination_token)
+    Optionally filtered server side by 'source' ("user", "system", or "engine-default").
+    """
 
-        # Iterate over the returned parameters.
-        for p in param_chunk['Parameters']:
-            parameters_to_return.append(p)
+    paginate_kwargs = {"DBParameterGroupName": param_group}
+    if source is not None:
+        paginate_kwargs["Source"] = source
 
-        # Boto3 returns a field "Marker" when the returned parameters have been paginated. If missing, time to return function.
-        if "Marker" in param_chunk:
-            pagination_token = param_chunk['Marker']
-        else:
-            pagination_token = False
+    # Boto3's paginator follows the "Marker" field until all parameters are returned.
+    paginator = rds_client_obj.get_paginator("describe_db_parameters")
 
-    return parameters_to_return
+    return list(paginator.paginate(**paginate_kwargs).search("Parameters[]"))
 
 ################################################################################
 #                                     Main                                     #
@@ -384,15 +423,19 @@ if __name__ == "__main__":
                        help='Destination region of parameter group.',
                        dest='dest_region',
                        type=str)
+    parser.add_argument('-v', '--verbose',
+                       help='Print each parameter as it is posted to the destination.',
+                       action='store_true')
     args = parser.parse_args()
+    verbose = args.verbose
 
     # Assume the dest AWS region is the same as the source if not given.
     if args.dest_region is None:
         args.dest_region = args.source_region
 
     # Create boto objects
-    source_client = boto3.client("rds", region_name=args.source_region)
-    dest_client = boto3.client("rds", region_name=args.dest_region)
+    source_client = boto3.client("rds", region_name=args.source_region, config=rds_client_config)
+    dest_client = boto3.client("rds", region_name=args.dest_region, config=rds_client_config)
 
     # Execute.
     if args.action == "compare" or args.action == "diff":